@@ -17,9 +17,14 @@
 import arcade
 import arcade.color
 import arcade.key
-from copy import deepcopy
-from Pieces import Piece
-from Util import Location, Cell
+import pyglet
+from Pieces import Piece, BITBOARD_STRIDE
+from Util import Location
+
+
+def _repeat_row(row_bits: int, rows: int, stride: int) -> int:
+    """Repeat the bits of one bitboard row for the given number of rows."""
+    return sum(row_bits << (row * stride) for row in range(rows))
 
 
 class FallingBlocks(arcade.Window):
@@ -36,6 +41,17 @@ class FallingBlocks(arcade.Window):
     CELL_HEIGHT = HEIGHT / ROWS
     EMPTY_CELL_COLOR = arcade.color.BEIGE
     BLOCKED_CELL_COLOR = arcade.color.BLUE
+    # Bitboard Setup
+    # The grid is one int with STRIDE bits per row from the bottom up, the first COLUMNS bits of a row are its cells
+    # The rest of a row's bits are wall, which is also the wall to the left of the row above,
+    # and FLOOR_ROWS rows of floor lie below the grid, so a piece that is out of bounds overlaps OUT_OF_BOUNDS
+    STRIDE = BITBOARD_STRIDE
+    FLOOR_ROWS = 5
+    ROW_MASK = (1 << COLUMNS) - 1
+    FIELD_MASK = _repeat_row(ROW_MASK, ROWS, STRIDE) << (FLOOR_ROWS * STRIDE)
+    FIRST_COLUMN_MASK = _repeat_row(1, ROWS, STRIDE) << (FLOOR_ROWS * STRIDE)
+    OUT_OF_BOUNDS = ((1 << (FLOOR_ROWS * STRIDE)) - 1) | (_repeat_row(((1 << STRIDE) - 1) ^ ROW_MASK, ROWS + 4, STRIDE)
+                                                          << (FLOOR_ROWS * STRIDE))
     # Piece Setup
     START_LOCATION = Location(ROWS - 2, COLUMNS // 2 - 2)
     # Scoring by number of lines
@@ -45,133 +61,221 @@ class FallingBlocks(arcade.Window):
     def __init__(self):
         super().__init__(self.WIDTH, self.HEIGHT, self.TITLE)
         arcade.set_background_color(self.BACKGROUND_COLOR)
-        # Fill with a grid of empty cells
-        self._grid: list[list[Cell]] = [[Cell.EMPTY for _ in range(self.COLUMNS)]
-                                        for _ in range(self.ROWS)]
+        # Play area rectangle never changes, so keep its geometry on the GPU
+        self._background_shapes = arcade.ShapeElementList()
+        self._background_shapes.append(arcade.create_rectangle_filled(self.WIDTH / 4, self.HEIGHT / 2, self.WIDTH / 2,
+                                                                      self.HEIGHT, self.EMPTY_CELL_COLOR))
+        # Fill with a grid of empty cells, a set bit is a blocked cell
+        self._grid = 0
+        # The row above the topmost blocked cell of each column
+        self._col_heights: list[int] = [0] * self.COLUMNS
+        # Every block on screen is a sprite in one sprite list, so they are all drawn as a single batch
+        self._block_sprites = arcade.SpriteList(use_spatial_hash=False)
+        # Pre-create one sprite per cell
+        # Sprites are only made visible when their cell is blocked and are in the same order as the grid
+        self._cell_sprites: list[arcade.Sprite] = []
+        for row in range(self.ROWS):
+            for col in range(self.COLUMNS):
+                sprite = self._make_block_sprite(self.BLOCKED_CELL_COLOR)
+                sprite.center_x = col * self.CELL_WIDTH + self.CELL_WIDTH / 2
+                sprite.center_y = row * self.CELL_HEIGHT + self.CELL_HEIGHT / 2
+                sprite.visible = False
+                self._cell_sprites.append(sprite)
+                self._block_sprites.append(sprite)
+        # Sprites are only updated before a draw when the grid or the piece changed since the last one
+        self._grid_dirty = False
+        self._piece_dirty = True
+        # Nothing moves between game play updates, so frames are only drawn after something changed
+        self._needs_redraw = True
+        self._frame_drawn = False
+        # Every piece is made of 4 blocks, so 4 sprites each are enough for the piece and next piece
+        self._piece_sprites = [self._make_block_sprite(arcade.color.WHITE) for _ in range(4)]
+        self._next_piece_sprites = [self._make_block_sprite(arcade.color.WHITE) for _ in range(4)]
+        self._block_sprites.extend(self._piece_sprites + self._next_piece_sprites)
         # Generate pieces
-        self._next_piece = Piece.random(deepcopy(self.START_LOCATION))
-        self._generate_pieces()
+        self._piece = Piece.random(self.START_LOCATION)
+        self._next_piece = Piece.random(self.START_LOCATION)
+        self._update_next_piece_sprites()
         # Setup statistics
         self._level = 1
         self._lines = 0
         self._score = 0
         self._gameover = False
-        # Schedule game play update interval, no smaller than 0.1 seconds
-        arcade.schedule(self._down, max(1 - self._level * .1, 0.1))
+        # Persistent text labels only lay themselves out again when their text changes
+        # They are all in one batch so they are drawn together
+        self._text_batch = pyglet.graphics.Batch()
+        self._next_piece_text = self._make_text("Next Piece", self.WIDTH / 2, self.HEIGHT - self.HEIGHT / 8)
+        self._level_text = self._make_text("Level\n" + str(self._level), self.WIDTH / 2, self.HEIGHT / 8 * 4)
+        self._lines_text = self._make_text("Lines\n" + str(self._lines), self.WIDTH / 2, self.HEIGHT / 8 * 3)
+        self._score_text = self._make_text("Score\n" + str(self._score), self.WIDTH / 2, self.HEIGHT / 8 * 2)
+        self._gameover_text = self._make_text("", 0, self.HEIGHT / 2, 32)  # Filled in when the game is over
+        # Game play update interval, no smaller than 0.1 seconds
+        self._step_interval = max(1 - self._level * .1, 0.1)
+        self._time_since_step = 0.0
+        # Game play updates are much further apart than frames, so on_update does not need to run every frame
+        self.set_update_rate(1 / 30)
 
     def _generate_pieces(self) -> None:
+        # Only the piece and the next piece are ever needed, so the old piece is reused as the next piece
+        old_piece = self._piece
         self._piece = self._next_piece
-        self._next_piece = Piece.random(deepcopy(self.START_LOCATION))
+        old_piece.respawn(self.START_LOCATION)
+        self._next_piece = old_piece
+        self._update_next_piece_sprites()
+
+    def _make_text(self, text: str, x: float, y: float, font_size: int = 18) -> pyglet.text.Label:
+        return pyglet.text.Label(text, font_name=("calibri", "arial"), font_size=font_size, x=x, y=y,
+                                 width=self.WIDTH // 2, align="center", multiline=True,
+                                 color=arcade.color.WHITE + (255,), batch=self._text_batch)
+
+    def _make_block_sprite(self, color: tuple[int, int, int]) -> arcade.Sprite:
+        return arcade.SpriteSolidColor(int(self.CELL_WIDTH), int(self.CELL_HEIGHT), color)
+
+    def _update_cell_sprites(self) -> None:
+        """Show the sprite of every blocked cell and hide the rest."""
+        for row in range(self.ROWS):
+            row_bits = self._grid >> ((row + self.FLOOR_ROWS) * self.STRIDE)
+            for col in range(self.COLUMNS):
+                self._cell_sprites[row * self.COLUMNS + col].visible = bool(row_bits >> col & 1)
+
+    def _update_piece_sprites(self) -> None:
+        for sprite, (row, col) in zip(self._piece_sprites, self._piece.grid_locations):
+            sprite.color = self._piece.color
+            sprite.center_x = col * self.CELL_WIDTH + self.CELL_WIDTH / 2
+            sprite.center_y = row * self.CELL_HEIGHT + self.CELL_HEIGHT / 2
+
+    def _update_next_piece_sprites(self) -> None:
+        for sprite, (row, col) in zip(self._next_piece_sprites, self._next_piece.offsets):
+            sprite.color = self._next_piece.color
+            sprite.center_x = col * self.CELL_WIDTH + self.WIDTH / 2 + self.WIDTH / 6 + self.CELL_WIDTH / 2
+            sprite.center_y = row * self.CELL_HEIGHT + self.HEIGHT / 8 * 5 + self.CELL_HEIGHT / 2
 
     def on_draw(self):
+        # Keep showing the last frame if nothing changed since it was drawn
+        if not self._needs_redraw:
+            return
+        self._needs_redraw = False
+        self._frame_drawn = True
         # Must be called before drawing anything
         arcade.start_render()
         # Draw grid
         # Play area rectangle
-        arcade.draw_xywh_rectangle_filled(0, 0, self.WIDTH / 2, self.HEIGHT, self.EMPTY_CELL_COLOR)
-        # Rectangles for each blocked cell
-        for row in range(self.ROWS):
-            for col in range(self.COLUMNS):
-                if self._grid[row][col] is Cell.BLOCK:
-                    arcade.draw_xywh_rectangle_filled(col * self.CELL_WIDTH, row * self.CELL_HEIGHT,
-                                                      self.CELL_WIDTH, self.CELL_HEIGHT, self.BLOCKED_CELL_COLOR)
-        # Draw piece
-        for location in self._piece.grid_locations:
-            arcade.draw_xywh_rectangle_filled(location.column * self.CELL_WIDTH, location.row * self.CELL_HEIGHT,
-                                              self.CELL_WIDTH, self.CELL_HEIGHT, self._piece.color)
-        # Draw next piece and score
+        self._background_shapes.draw()
+        # Blocked cells, piece and next piece, all in one batch
+        if self._grid_dirty:
+            self._update_cell_sprites()
+            self._grid_dirty = False
+        if self._piece_dirty:
+            self._update_piece_sprites()
+            self._piece_dirty = False
+        self._block_sprites.draw()
+        # Draw score
         self._draw_info()
 
+    def flip(self):
+        # Only swap in frames that were drawn, the back buffer of a skipped frame is stale
+        if self._frame_drawn:
+            self._frame_drawn = False
+            super().flip()
+
+    def on_expose(self):
+        # The window contents were lost, for instance by another window covering it
+        self._needs_redraw = True
+
     def _draw_info(self) -> None:
-        # Draw Next Piece
-        arcade.draw_text("Next Piece", self.WIDTH / 2, self.HEIGHT - self.HEIGHT / 8, arcade.color.WHITE, 18,
-                         self.WIDTH // 2, "center")
-        for row in range(len(self._next_piece.position)):
-            for col in range(len(self._next_piece.position[0])):
-                cell = self._next_piece.position[row][col]
-                if cell is Cell.BLOCK:
-                    arcade.draw_xywh_rectangle_filled(col * self.CELL_WIDTH + self.WIDTH / 2 + self.WIDTH / 6,
-                                                      row * self.CELL_HEIGHT + self.HEIGHT / 8 * 5,
-                                                      self.CELL_WIDTH, self.CELL_HEIGHT, self._next_piece.color)
-        # Draw stats
-        arcade.draw_text("Level\n" + str(self._level), self.WIDTH / 2, self.HEIGHT / 8 * 4,
-                         arcade.color.WHITE, 18,
-                         self.WIDTH // 2, "center")
-        arcade.draw_text("Lines\n" + str(self._lines), self.WIDTH / 2, self.HEIGHT / 8 * 3,
-                         arcade.color.WHITE, 18,
-                         self.WIDTH // 2, "center")
-        arcade.draw_text("Score\n" + str(self._score), self.WIDTH / 2, self.HEIGHT / 8 * 2,
-                         arcade.color.WHITE, 18,
-                         self.WIDTH // 2, "center")
-        if self._gameover:
-            arcade.draw_text("Game Over", 0, self.HEIGHT / 2,
-                             arcade.color.WHITE, 32,
-                             self.WIDTH // 2, "center")
+        # Draw Next Piece, stats and game over text
+        # Raw pyglet drawing needs arcade's pyglet rendering state
+        with self.ctx.pyglet_rendering():
+            self._text_batch.draw()
+
+    def on_update(self, delta_time: float):
+        # Run as many game play updates as are due, so none are lost when frames are slow
+        self._time_since_step += delta_time
+        while self._time_since_step >= self._step_interval and not self._gameover:
+            self._time_since_step -= self._step_interval
+            self._down(self._step_interval)
 
     def _invalid(self) -> bool:
         """Is this an invalid game state?"""
-        # Check if the piece overlaps any of the blocked cells
-        for location in self._piece.grid_locations:
-            if location.row < 0:
-                return True
-            if location.column < 0:
-                return True
-            if location.column >= self.COLUMNS:
-                return True
-            # Order matters, we must not go "off the grid" so we check too far left, right or down first
-            try:
-                if self._grid[location.row][location.column] is Cell.BLOCK:
-                    return True
-            except IndexError:  # Ignore if we're off grid too high up
-                continue
-        return False
+        # Check if the piece overlaps any of the blocked cells, the walls or the floor
+        # Off grid too high up is fine, the walls go higher than the grid but nothing else is there
+        return (self._piece_bitboard() & (self._grid | self.OUT_OF_BOUNDS)) != 0
+
+    def _piece_bitboard(self) -> int:
+        return self._piece.mask << ((self._piece.row + self.FLOOR_ROWS) * self.STRIDE + self._piece.column)
 
     def _down(self, dt: float) -> None:
+        self._piece_dirty = True
+        self._needs_redraw = True
         self._piece.move_down()
         # If we hit the bottom, undo and go to next piece
         if self._invalid():
             self._piece.move_up()  # Undo
             # Transfer pieces to grid
-            for location in self._piece.grid_locations:
-                try:
-                    self._grid[location.row][location.column] = Cell.BLOCK
-                except IndexError:  # Ignore if we're off grid too high up
-                    continue
+            self._grid |= self._piece_bitboard() & self.FIELD_MASK
+            self._grid_dirty = True
+            for row, col in self._piece.grid_locations:
+                if row < self.ROWS:  # Ignore if we're off grid too high up
+                    self._col_heights[col] = max(self._col_heights[col], row + 1)
             # Change over to next piece
             self._generate_pieces()
             # If immediately after we generate the piece we are invalid, then we lost
             if self._invalid():
-                arcade.unschedule(self._down)
                 self._gameover = True
+                self._gameover_text.text = "Game Over"
             # Check for newly completed lines
             self._check_lines()
 
     def _check_lines(self) -> None:
         """Remove completed lines."""
-        # Go from bottom up, finding lines that are full or should be removed
-        indices_for_removal: list[int] = []
-        for index, row in enumerate(self._grid):
-            if all(cell is Cell.BLOCK for cell in row):
-                indices_for_removal.append(index)
-        # Remove each line that should be removed and add a blank line to top of grid
-        # Must remove from the top down so subsequent indices are still correct
-        for index in reversed(indices_for_removal):
-            del self._grid[index]
-            self._grid.append([Cell.EMPTY] * self.COLUMNS)
+        # Find full lines in every row at once, after ANDing each cell with the cells to its right,
+        # the first column of a line is still set only if the whole line is
+        full_lines = self._grid
+        run = 1
+        while run < self.COLUMNS:
+            step = min(run, self.COLUMNS - run)
+            full_lines &= full_lines >> step
+            run += step
+        full_lines &= self.FIRST_COLUMN_MASK
+        if full_lines == 0:
+            return
+        # Go from bottom up, copying each line that is not full down to the next free line
+        # Full lines are skipped, so everything above them moves down and empty lines fill the top
+        grid = 0
+        free_row = 0
+        for row in range(self.ROWS):
+            shift = (row + self.FLOOR_ROWS) * self.STRIDE
+            if not full_lines >> shift & 1:
+                grid |= ((self._grid >> shift) & self.ROW_MASK) << ((free_row + self.FLOOR_ROWS) * self.STRIDE)
+                free_row += 1
+        self._grid = grid
+        self._update_col_heights()
         # Update statistics
-        lines_cleared = len(indices_for_removal)
-        if lines_cleared > 0:
-            self._lines += lines_cleared
-            self._score += self.SCORING[lines_cleared] * self._level
-            old_level = self._level
-            self._level = (self._lines // self.LINES_PER_LEVEL) + 1
-            if old_level != self._level:  # reschedule if level changed
-                arcade.unschedule(self._down)
-                arcade.schedule(self._down, max(1 - self._level * .1, 0.1))
+        lines_cleared = self.ROWS - free_row
+        self._lines += lines_cleared
+        self._score += self.SCORING[lines_cleared] * self._level
+        old_level = self._level
+        self._level = (self._lines // self.LINES_PER_LEVEL) + 1
+        self._level_text.text = "Level\n" + str(self._level)
+        self._lines_text.text = "Lines\n" + str(self._lines)
+        self._score_text.text = "Score\n" + str(self._score)
+        if old_level != self._level:  # speed up if level changed
+            self._step_interval = max(1 - self._level * .1, 0.1)
+
+    def _update_col_heights(self) -> None:
+        """Find the row above the topmost blocked cell of each column from the grid."""
+        for col in range(self.COLUMNS):
+            height = 0
+            for row in range(self.ROWS):
+                if self._grid >> ((row + self.FLOOR_ROWS) * self.STRIDE + col) & 1:
+                    height = row + 1
+            self._col_heights[col] = height
 
     def on_key_press(self, symbol: int, modifiers: int):
         # Try to do what the user asks, but if it puts us in an
         # invalid state, then undo it
+        self._piece_dirty = True
+        self._needs_redraw = True
         if symbol == arcade.key.A or symbol == arcade.key.LEFT:  # move left
             self._piece.move_left()
             if self._invalid():
@@ -189,6 +293,12 @@ class FallingBlocks(arcade.Window):
             if self._invalid():
                 self._piece.rotate_right()
         elif symbol == arcade.key.SPACE:  # straight down
+            # Every block can fall to the top of its column, so the piece falls as far as its closest block can
+            drop = min(row - self._col_heights[col] for row, col in self._piece.grid_locations)
+            if drop >= 0:
+                self._piece.move_down(drop)
+                return
+            # Some block is below the top of its column (under an overhang), so fall one row at a time
             while True:
                 self._piece.move_down()
                 if self._invalid():
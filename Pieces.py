@@ -21,185 +21,198 @@ from Util import Cell, Location
 import random
 
 # Aliases to make the rest of this file more readable
-Position = list[list[Cell]]
+Position = tuple[tuple[Cell, ...], ...]
 E = Cell.EMPTY
 B = Cell.BLOCK
+# Bits per grid row when a piece is placed on a bitboard
+# Leaves room for at least 4 bits of wall past the last column on grids up to 12 columns wide
+BITBOARD_STRIDE = 16
 
 
 class Piece:
-    def __init__(self, positions: list[Position], color: tuple[int, int, int], location: Location):
-        self._positions: list[Position] = positions
-        self._color = color
+    def __init__(self, kind: int, location: Location):
+        # Index of the kind of piece in the PIECE_ tables
+        self._kind = kind
         self._position_index = 0
-        self._location = location
+        self._row = location.row
+        self._column = location.column
 
     def rotate_right(self) -> None:
-        self._position_index = (self._position_index + 1) % len(self._positions)
+        self._position_index = (self._position_index + 1) % len(PIECE_POSITIONS[self._kind])
 
     def rotate_left(self) -> None:
-        self._position_index = (self._position_index - 1) % len(self._positions)
+        self._position_index = (self._position_index - 1) % len(PIECE_POSITIONS[self._kind])
 
     def move_right(self):
-        self._location.column += 1
+        self._column += 1
 
     def move_left(self):
-        self._location.column -= 1
+        self._column -= 1
 
-    def move_down(self):
-        self._location.row -= 1
+    def move_down(self, rows: int = 1):
+        self._row -= rows
 
     def move_up(self):
-        self._location.row += 1
+        self._row += 1
 
     @property
     def color(self) -> tuple[int, int, int]:
-        return self._color
+        return PIECE_COLORS[self._kind]
 
     @property
-    def position(self) -> Position:
-        return self._positions[self._position_index]
+    def row(self) -> int:
+        return self._row
 
     @property
-    def grid_locations(self) -> list[Location]:
-        locations = []
-        for row in range(len(self.position)):
-            for col in range(len(self.position[0])):
-                cell = self.position[row][col]
-                if cell is Cell.BLOCK:
-                    locations.append(Location(row + self._location.row,
-                                              col + self._location.column))
-        return locations
-
-    @staticmethod
-    def random(location: Location) -> Piece:
-        """Get a random piece."""
-        possible_pieces = (I, O, J, L, S, T, Z)
-        return random.choice(possible_pieces)(location)
-
-
-class I(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E, E],
-                     [E, E, E, E],
-                     [B, B, B, B],
-                     [E, E, E, E]]
-
-        position1 = [[E, E, B, E],
-                     [E, E, B, E],
-                     [E, E, B, E],
-                     [E, E, B, E]]
-
-        positions = [position0, position1]
-
-        super().__init__(positions, arcade.color.AMBER, location)
-
-
-class O(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E, E],
-                     [E, B, B, E],
-                     [E, B, B, E],
-                     [E, E, E, E]]
-
-        positions = [position0]
-
-        super().__init__(positions, arcade.color.RED, location)
-
-
-class J(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E],
-                     [B, B, B],
-                     [E, E, B]]
-
-        position1 = [[E, B, E],
-                     [E, B, E],
-                     [B, B, E]]
-
-        position2 = [[B, E, E],
-                     [B, B, B],
-                     [E, E, E]]
-
-        position3 = [[E, B, B],
-                     [E, B, E],
-                     [E, B, E]]
-
-        positions = [position0, position1, position2, position3]
-
-        super().__init__(positions, arcade.color.ALMOND, location)
-
-
-class L(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E],
-                     [B, B, B],
-                     [B, E, E]]
-
-        position1 = [[B, B, E],
-                     [E, B, E],
-                     [E, B, E]]
+    def column(self) -> int:
+        return self._column
 
-        position2 = [[E, E, B],
-                     [B, B, B],
-                     [E, E, E]]
-
-        position3 = [[E, B, E],
-                     [E, B, E],
-                     [E, B, B]]
-
-        positions = [position0, position1, position2, position3]
-
-        super().__init__(positions, arcade.color.INDIGO, location)
-
-
-class S(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E],
-                     [E, B, B],
-                     [B, B, E]]
-
-        position1 = [[E, B, E],
-                     [E, B, B],
-                     [E, E, B]]
-
-        positions = [position0, position1]
-
-        super().__init__(positions, arcade.color.AQUA, location)
-
-
-class T(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E],
-                     [B, B, B],
-                     [E, B, E]]
-
-        position1 = [[E, B, E],
-                     [B, B, E],
-                     [E, B, E]]
-
-        position2 = [[E, B, E],
-                     [B, B, B],
-                     [E, E, E]]
-
-        position3 = [[E, B, E],
-                     [E, B, B],
-                     [E, B, E]]
-
-        positions = [position0, position1, position2, position3]
-
-        super().__init__(positions, arcade.color.EUCALYPTUS, location)
+    @property
+    def mask(self) -> int:
+        """The current position as a bitboard of BITBOARD_STRIDE bits per row."""
+        return PIECE_MASKS[self._kind][self._position_index]
 
+    @property
+    def position(self) -> Position:
+        return PIECE_POSITIONS[self._kind][self._position_index]
 
-class Z(Piece):
-    def __init__(self, location: Location):
-        position0 = [[E, E, E],
-                     [B, B, E],
-                     [E, B, B]]
+    @property
+    def offsets(self) -> tuple[tuple[int, int], ...]:
+        """The (row, column) of each block relative to the piece's location."""
+        return PIECE_OFFSETS[self._kind][self._position_index]
 
-        position1 = [[E, E, B],
-                     [E, B, B],
-                     [E, B, E]]
+    @property
+    def grid_locations(self) -> list[tuple[int, int]]:
+        """The (row, column) of each block on the grid."""
+        return [(row + self._row, col + self._column) for row, col in PIECE_OFFSETS[self._kind][self._position_index]]
 
-        positions = [position0, position1]
+    def respawn(self, location: Location) -> None:
+        """Turn this piece into a new random piece at location, so a piece can be reused."""
+        self._kind = random.randrange(len(PIECE_POSITIONS))
+        self._position_index = 0
+        self._row = location.row
+        self._column = location.column
 
-        super().__init__(positions, arcade.color.GRAY, location)
+    @staticmethod
+    def random(location: Location) -> Piece:
+        """Get a random piece."""
+        return Piece(random.randrange(len(PIECE_POSITIONS)), location)
+
+
+def _offsets(position: Position) -> tuple[tuple[int, int], ...]:
+    """The (row, column) of each block in a position."""
+    return tuple((row, col) for row in range(len(position)) for col in range(len(position[0]))
+                 if position[row][col] is B)
+
+
+def _mask(offsets: tuple[tuple[int, int], ...]) -> int:
+    """Blocks at the given (row, column) offsets as a bitboard of BITBOARD_STRIDE bits per row."""
+    return sum(1 << (row * BITBOARD_STRIDE + col) for row, col in offsets)
+
+
+# Positions of each kind of piece, in the order they rotate through
+_I_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E, E),
+     (E, E, E, E),
+     (B, B, B, B),
+     (E, E, E, E)),
+
+    ((E, E, B, E),
+     (E, E, B, E),
+     (E, E, B, E),
+     (E, E, B, E))
+)
+
+_O_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E, E),
+     (E, B, B, E),
+     (E, B, B, E),
+     (E, E, E, E)),
+)
+
+_J_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E),
+     (B, B, B),
+     (E, E, B)),
+
+    ((E, B, E),
+     (E, B, E),
+     (B, B, E)),
+
+    ((B, E, E),
+     (B, B, B),
+     (E, E, E)),
+
+    ((E, B, B),
+     (E, B, E),
+     (E, B, E))
+)
+
+_L_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E),
+     (B, B, B),
+     (B, E, E)),
+
+    ((B, B, E),
+     (E, B, E),
+     (E, B, E)),
+
+    ((E, E, B),
+     (B, B, B),
+     (E, E, E)),
+
+    ((E, B, E),
+     (E, B, E),
+     (E, B, B))
+)
+
+_S_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E),
+     (E, B, B),
+     (B, B, E)),
+
+    ((E, B, E),
+     (E, B, B),
+     (E, E, B))
+)
+
+_T_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E),
+     (B, B, B),
+     (E, B, E)),
+
+    ((E, B, E),
+     (B, B, E),
+     (E, B, E)),
+
+    ((E, B, E),
+     (B, B, B),
+     (E, E, E)),
+
+    ((E, B, E),
+     (E, B, B),
+     (E, B, E))
+)
+
+_Z_POSITIONS: tuple[Position, ...] = (
+    ((E, E, E),
+     (B, B, E),
+     (E, B, B)),
+
+    ((E, E, B),
+     (E, B, B),
+     (E, B, E))
+)
+
+# Every kind of piece, looked up by the same index in each table
+PIECE_POSITIONS: tuple[tuple[Position, ...], ...] = (_I_POSITIONS, _O_POSITIONS, _J_POSITIONS, _L_POSITIONS,
+                                                       _S_POSITIONS, _T_POSITIONS, _Z_POSITIONS)
+PIECE_COLORS: tuple[tuple[int, int, int], ...] = (arcade.color.AMBER, arcade.color.RED, arcade.color.ALMOND,
+                                                  arcade.color.INDIGO, arcade.color.AQUA, arcade.color.EUCALYPTUS,
+                                                  arcade.color.GRAY)
+# Block offsets and bitboards of every position, computed once for all pieces
+PIECE_OFFSETS: tuple[tuple[tuple[tuple[int, int], ...], ...], ...] = tuple(tuple(_offsets(position)
+                                                                                 for position in positions)
+                                                                           for positions in PIECE_POSITIONS)
+PIECE_MASKS: tuple[tuple[int, ...], ...] = tuple(tuple(_mask(offsets) for offsets in kind_offsets)
+                                                 for kind_offsets in PIECE_OFFSETS)
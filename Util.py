@@ -14,16 +14,15 @@
 #
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>
-from enum import Enum, auto
-from dataclasses import dataclass
+from enum import IntEnum
+from typing import NamedTuple
 
 
-class Cell(Enum):
-    EMPTY = auto()
-    BLOCK = auto()
+class Cell(IntEnum):
+    EMPTY = 0
+    BLOCK = 1
 
 
-@dataclass
-class Location:
+class Location(NamedTuple):
     row: int
     column: int